@@ -1,14 +1,24 @@
 # api.py
 
+import functools
 import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    # orjson decodes the GraphQL responses several times faster, the stdlib parser is the fallback
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 from dotenv import load_dotenv
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.WARNING)
-
 # Load environment variables from .env file
 load_dotenv(".env")
 
@@ -19,59 +29,162 @@ headers = {
     #'Authorization': f"Bearer {os.getenv('HASURA_API_TOKEN')}"
 }
 
+# One session for all GraphQL calls so connections to the endpoint are kept alive and reused.
+# Every request is a read-only query, so POSTs are safe to retry on gateway errors.
+session = requests.Session()
+session.headers.update(headers)
+session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20,
+                                      max_retries=Retry(total=3, backoff_factor=0.3,
+                                                        status_forcelist=[502, 503, 504],
+                                                        allowed_methods=frozenset({'POST'}))))
+
+# Seconds to wait on the GraphQL endpoint before giving up (connect, read)
+GRAPHQL_TIMEOUT = (5, 15)
+
 # Load filter definitions from JSON file
 with open('filters.json', 'r') as f:
     filters_config = json.load(f)
 
+# Sub-filter menus per filter category, looked up on every menu render
+sub_filters_config = filters_config["sub_filters"]
+# (filter category, sub filter query) -> sub filter definition, replaces a linear scan per button press
+sub_filter_meta = {
+    (filter_type, sub_filter['query']): sub_filter
+    for filter_type, sub_filters in sub_filters_config.items()
+    for sub_filter in sub_filters
+}
+
+# Where-clause templates parsed once: filter name -> (field, template, whether it takes free text)
+profile_filter_clauses = {
+    filter_name: (template.split(":")[0].strip(), template, '"%value%"' in template)
+    for filter_name, template in filters_config["profile_filters"].items()
+    if filter_name != "root"
+}
+
+# Profile search results are cached for a few minutes, many users hit the same filter combinations
+PROFILES_CACHE_TTL = 300
+PROFILES_CACHE_MAXSIZE = 1024
+_profiles_cache = OrderedDict()
+# Single profiles are cached by id, the same card is sent and expanded many times
+PROFILE_CACHE_TTL = 300
+PROFILE_CACHE_MAXSIZE = 2048
+_profile_cache = OrderedDict()
+# Filter options (types, sectors, statuses...) rarely change, they are fetched in one batch at startup
+FILTER_OPTIONS_CACHE_TTL = 3600
+FILTER_OPTIONS_CACHE_MAXSIZE = 64
+_filter_options_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_get(cache, key):
+    """Return the cached value for key, or None if it is missing or expired."""
+    with _cache_lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+
+
+def _cache_set(cache, key, value, ttl, maxsize):
+    """Store value under key for ttl seconds, evicting the least recently used entries past maxsize."""
+    with _cache_lock:
+        cache[key] = (time.monotonic() + ttl, value)
+        cache.move_to_end(key)
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+
+
+def run_query(query, variables=None):
+    """Post a GraphQL query and return the decoded response, logging any GraphQL errors."""
+    payload = {'query': query}
+    if variables:
+        payload['variables'] = variables
+    response_data = json_loads(session.post(url, json=payload, timeout=GRAPHQL_TIMEOUT).content)
+    logging.debug("Query: %s %s", query, variables or '')
+    logging.debug("Response: %s", response_data)
+    if 'errors' in response_data:
+        logging.error("GraphQL query error: %s", response_data['errors'])
+    return response_data
+
+
+def _first_profile(response_data):
+    if 'errors' in response_data:
+        return {}
+    profile_data = response_data.get('data', {}).get('profiles', [])
+    return profile_data[0] if profile_data else {}
+
+
+def is_valid_id(value):
+    """Ids are sent as plain ascii digits (callback data) or ints, only those are ever put into a query."""
+    value = str(value)
+    return value.isascii() and value.isdigit()
+
 
 def apply_filters(filters):
-    combined_clauses = {}
+    filters_shape = []
+    variables = {}
     for filter_name, value in filters:
-        where_clause = filters_config["profile_filters"].get(filter_name)
-        if where_clause:
-            clause = where_clause.replace('value', f'{value}')
-            field = clause.split(":")[0].strip()
-            if field in combined_clauses:
-                combined_clauses[field].append(clause)
+        filter_clause = profile_filter_clauses.get(filter_name)
+        if filter_clause:
+            if filter_clause[2]:
+                # Free text is passed as a query variable so it can't break out of the query
+                variables[f"v{len(variables)}"] = f"%{value}%"
+                filters_shape.append((filter_name, None))
             else:
-                combined_clauses[field] = [clause]
+                # Every other filter compares an id, anything that isn't a plain ascii number is rejected
+                if not is_valid_id(value):
+                    logging.warning("Invalid value '%s' for filter '%s'.", value, filter_name)
+                    continue
+                filters_shape.append((filter_name, int(value)))
         else:
-            logging.warning(f"Filter '{filter_name}' not found.")
-
-    if combined_clauses:
-        final_clauses = []
-        for field, clauses in combined_clauses.items():
-            if len(clauses) > 1:
-                # Correctly combine clauses without repeating the field name
-                combined_field_clause = f"{field}: {{ _and: [{', '.join([clause.split(':', 1)[1].strip() for clause in clauses])}] }}"
-            else:
-                combined_field_clause = clauses[0]
-            final_clauses.append(combined_field_clause)
-
-        combined_where_clause = ", ".join(final_clauses)
-        where_clause = f"{{ {combined_where_clause} }}"
-        query = f"query queryName {{ profiles (where: {where_clause}) {{ name id }} }}"
-        print("GraphQL Query:", query)  # Debug statement
-        response = requests.post(url, headers=headers, json={'query': query})
-        response_data = response.json()
-        logging.info(f"Query: {query}")
-        logging.info(f"Response: {response_data}")
-        return response_data
+            logging.warning("Filter '%s' not found.", filter_name)
+
+    if filters_shape:
+        return run_query(build_filters_query(tuple(filters_shape)), variables)
     else:
         logging.warning("No valid filters found.")
         return None
 
 
-def fetch_all_filter_queries():
-    results = {}
-    for filter_name, query in filters_config["filters_queries"].items():
-        full_query = f"query {{ {query} }}"
-        response = requests.post(url, headers=headers, json={'query': full_query})
-        response_data = response.json()
-        logging.info(f"Query: {full_query}")
-        logging.info(f"Response: {response_data}")
-        results[filter_name] = response_data
-    return results
+@functools.lru_cache(maxsize=256)
+def build_filters_query(filters_shape):
+    """Build the profiles query for a tuple of (filter_name, id) pairs, id is None for free-text filters.
+
+    Free-text values are not part of the query text, so searches for different terms share one cached query.
+    """
+    combined_clauses = {}
+    variable_definitions = []
+    for filter_name, value in filters_shape:
+        field, where_clause, _ = profile_filter_clauses[filter_name]
+        if value is None:
+            variable_name = f"v{len(variable_definitions)}"
+            clause = where_clause.replace('"%value%"', f'${variable_name}')
+            variable_definitions.append(f"${variable_name}: String")
+        else:
+            clause = where_clause.replace('value', f'{value}')
+        if field in combined_clauses:
+            combined_clauses[field].append(clause)
+        else:
+            combined_clauses[field] = [clause]
+
+    final_clauses = []
+    for field, clauses in combined_clauses.items():
+        if len(clauses) > 1:
+            # Correctly combine clauses without repeating the field name
+            combined_field_clause = f"{field}: {{ _and: [{', '.join([clause.split(':', 1)[1].strip() for clause in clauses])}] }}"
+        else:
+            combined_field_clause = clauses[0]
+        final_clauses.append(combined_field_clause)
+
+    combined_where_clause = ", ".join(final_clauses)
+    where_clause = f"{{ {combined_where_clause} }}"
+    query_arguments = f"({', '.join(variable_definitions)})" if variable_definitions else ""
+    return f"query queryName{query_arguments} {{ profiles (where: {where_clause}) {{ id }} }}"
 
 
 def get_profiles(data):
@@ -92,7 +205,7 @@ def get_profiles(data):
                     key = 'profileNameSearch_query'
             filter_name = key.replace('_query', '')
             filters[filter_name] = value
-    print("filters", filters)
+    logging.debug("filters %s", filters)
 
     if data.get('solana_filter_toggle', True) is True: #
         filters['solana_profiles_only'] = 22
@@ -105,41 +218,39 @@ def get_profiles(data):
         }
 
 
+    cache_key = tuple(sorted(filters.items()))
+    profiles = _cache_get(_profiles_cache, cache_key)
+    if profiles is not None:
+        return profiles
+
     filters_list = [(filter_name, value) for filter_name, value in filters.items()]
 
     filtered_profiles = apply_filters(filters_list)
-    print("filters_list", filtered_profiles)
-    return filtered_profiles['data']['profiles']
+    logging.debug("filters_list %s", filtered_profiles)
+    # No valid filters (None) or a failed query (no data) count as no results and are not cached
+    profiles = ((filtered_profiles or {}).get('data') or {}).get('profiles')
+    if profiles is None:
+        return []
+    _cache_set(_profiles_cache, cache_key, profiles, PROFILES_CACHE_TTL, PROFILES_CACHE_MAXSIZE)
+    return profiles
 
 
 def get_profile_data_by_id(profile_id):
-    query = f"""
-    query {{
-        profiles(where: {{ id: {{ _eq: {profile_id} }} }}) {{
-            name
-            id
-            profileSector {{ name }}
-            products {{ name }}
-            assets {{ name }}
-            tagLine
-            descriptionShort
-            logo
-            urlMain
-            urlDocumentation
-            socials {{ url }}
-        }}
-    }}
-    """
-    response = requests.post(url, headers=headers, json={'query': query})
-    response_data = response.json()
-    if 'errors' in response_data:
-        logging.error(f"GraphQL query error: {response_data['errors']}")
-        return {}
-    profile_data = response_data.get('data', {}).get('profiles', [])
-    return profile_data[0] if profile_data else {}
+    # The card is built from the full profile, so a later expand of the same profile is served from the cache
+    return get_full_profile_data_by_id(profile_id)
 
 
 def get_full_profile_data_by_id(profile_id):
+    # The id is interpolated into the query, anything else is rejected before it gets there
+    if not is_valid_id(profile_id):
+        logging.warning("Invalid profile id '%s'.", profile_id)
+        return {}
+    profile_id = int(profile_id)
+
+    profile = _cache_get(_profile_cache, profile_id)
+    if profile is not None:
+        return profile
+
     query = f"""
     query {{
         profiles(where: {{ id: {{ _eq: {profile_id} }} }}) {{
@@ -164,44 +275,49 @@ def get_full_profile_data_by_id(profile_id):
         }}
     }}
     """
-    response = requests.post(url, headers=headers, json={'query': query})
-    response_data = response.json()
-    if 'errors' in response_data:
-        logging.error(f"GraphQL query error: {response_data['errors']}")
-        return {}
-    profile_data = response_data.get('data', {}).get('profiles', [])
-    return profile_data[0] if profile_data else {}
+    profile = _first_profile(run_query(query))
+    if profile:
+        _cache_set(_profile_cache, profile_id, profile, PROFILE_CACHE_TTL, PROFILE_CACHE_MAXSIZE)
+    return profile
 
 
 def get_sub_filters(filter_type):
-    return filters_config["sub_filters"].get(filter_type, [])
+    return sub_filters_config.get(filter_type, [])
+
+
+def get_sub_filter_meta(filter_type, query):
+    return sub_filter_meta.get((filter_type, query))
 
 
 def fetch_filter_options(query):
+    options = _cache_get(_filter_options_cache, query)
+    if options is not None:
+        return options
+
     full_query = f"query {{ {query} }}"
-    response = requests.post(url, headers=headers, json={'query': full_query})
-    response_data = response.json()
+    response_data = run_query(full_query)
     if 'errors' in response_data:
-        logging.error(f"GraphQL query error: {response_data['errors']}")
         return []
-    return response_data.get('data', {}).get(query.split()[0], [])
-
-# # Example usage
-# filters = [
-#     ("profileNameSearch", "Noice"),
-#     ("entityTypes", 4),
-#     ("entityName", "O"),
-# ]
-# apply_filters(filters)
-
-#print(len(get_profiles({})))
-# # Example usage:
-# data = {
-#     "FILTERS": {
-#         "profileType_id": 8,
-#         "profileSector_id": 825
-#     }
-# }
-# all = []
-# for filter_name, value in data["FILTERS"].items():
-#     all = apply_filters(filter_name, value)["data"]["profiles"]
+    options = response_data.get('data', {}).get(query.split()[0], [])
+    _cache_set(_filter_options_cache, query, options, FILTER_OPTIONS_CACHE_TTL, FILTER_OPTIONS_CACHE_MAXSIZE)
+    return options
+
+
+def prefetch_filter_options():
+    """Fetch the options of every multiple-choice sub filter in one aliased query and cache them."""
+    queries = list(dict.fromkeys(
+        filters_config["filters_queries"][sub_filter['query']]
+        for sub_filters in sub_filters_config.values()
+        for sub_filter in sub_filters
+        if sub_filter['type'] == 'multiple'
+    ))
+    if not queries:
+        return
+    aliased_queries = " ".join(f"q{n}: {query}" for n, query in enumerate(queries))
+    response_data = run_query(f"query {{ {aliased_queries} }}")
+    if 'errors' in response_data:
+        return
+    data = response_data.get('data', {})
+    for n, query in enumerate(queries):
+        _cache_set(_filter_options_cache, query, data.get(f"q{n}", []), FILTER_OPTIONS_CACHE_TTL,
+                   FILTER_OPTIONS_CACHE_MAXSIZE)
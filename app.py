@@ -1,13 +1,17 @@
+import atexit
 import logging
-import logging.config
+import logging.handlers
 import os
+import queue
 import sys
-from telegram.ext import MessageHandler, Updater, CallbackQueryHandler
+from telegram.ext import Updater
 
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from dotenv import load_dotenv
 
+import api
+import database
 from handlers.setup import setup
 
 # Load environment variables from a .env file
@@ -23,6 +27,10 @@ def error(update, context):
 
 
 def main():
+    # without a public url the webhook would be registered as "/<token>" and fail inside the Telegram bootstrap
+    if DefaultConfig.MODE == "webhook" and not DefaultConfig.WEBHOOK_URL:
+        sys.exit("LAMBDA_WEBHOOK_URL must be set when MODE is webhook")
+
     updater = Updater(DefaultConfig.TELEGRAM_TOKEN, use_context=True)
     dp = updater.dispatcher
 
@@ -32,19 +40,29 @@ def main():
     # log all errors
     dp.add_error_handler(error)
 
+    # warm the filter option menus with a single request, they are fetched on demand if this fails
+    try:
+        api.prefetch_filter_options()
+    except Exception as e:
+        logging.warning("Could not prefetch filter options: %s", e)
+
+    # write any stats still queued when the bot stops
+    atexit.register(database.flush_fetch_counts)
+
     # Start the Bot
     if DefaultConfig.MODE == "webhook":
         updater.start_webhook(
             listen="0.0.0.0",
             port=int(DefaultConfig.PORT),
             url_path=DefaultConfig.TELEGRAM_TOKEN,
-            webhook_url=DefaultConfig.WEBHOOK_URL + '/' + DefaultConfig.TELEGRAM_TOKEN
+            webhook_url=f"{DefaultConfig.WEBHOOK_URL}/{DefaultConfig.TELEGRAM_TOKEN}"
         )
 
-        logging.info(f"Start webhook mode on port {DefaultConfig.PORT}")
+        logging.info("Start webhook mode on port %s", DefaultConfig.PORT)
     else:
-        updater.start_polling()
-        logging.info(f"Start polling mode")
+        # long polling: Telegram holds each getUpdates call open until an update arrives
+        updater.start_polling(timeout=30, drop_pending_updates=True)
+        logging.info("Start polling mode")
 
     updater.idle()
 
@@ -53,20 +71,34 @@ class DefaultConfig:
     PORT = int(os.environ.get("PORT", 5000))
     TELEGRAM_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
     MODE = os.environ.get("MODE", "webhook")
-    WEBHOOK_URL = os.environ.get("LAMBDA_WEBHOOK_URL", "https://9153-2405-3800-803-d061-1c1b-4adc-b676-5f6d.ngrok-free.app")
+    WEBHOOK_URL = os.environ.get("LAMBDA_WEBHOOK_URL", "")
     LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
 
     @staticmethod
     def init_logging():
+        # Log calls only merge the message arguments and enqueue the record,
+        # the full formatting and the writes happen on the listener thread
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, console_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+
+        # the queue handler must only render the message, basicConfig would otherwise give it its default format
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
+        # force replaces any handler installed by modules imported before this point
         logging.basicConfig(
-            format="%(asctime)s - %(levelname)s - %(message)s",
             level=DefaultConfig.LOG_LEVEL,
+            handlers=[queue_handler],
+            force=True,
         )
 
 
 if __name__ == "__main__":
     # Enable logging
     DefaultConfig.init_logging()
-    logging.info(f"PORT: {DefaultConfig.PORT}")
+    logging.info("PORT: %s", DefaultConfig.PORT)
     main()
-    # API.run_API()
\ No newline at end of file
@@ -1,28 +1,75 @@
+import functools
+import logging
 import os
-import mysql.connector
+import threading
+from collections import Counter
+
 from mysql.connector import Error
+from mysql.connector import pooling
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
-load_dotenv()
+load_dotenv(".env")
+
+# Fetch counts are accumulated in memory and written in batches by flush_fetch_counts()
+_pending_fetch_counts = Counter()
+_pending_fetch_counts_lock = threading.Lock()
+
+# Connections are reused from a pool instead of opening a new one per query
+DB_POOL_SIZE = min(max(5, (os.cpu_count() or 1) * 2), 25)
+_pool = None
+_pool_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def db_config():
+    """Read the connection settings from the environment once, on first use."""
+    # read lazily so .env files loaded after this module is imported are still picked up
+    return {
+        'host': os.getenv('DB_HOST'),
+        'database': os.getenv('DB_DATABASE'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'port': os.getenv('DB_PORT'),
+    }
+
+
+def get_pool():
+    """Create the connection pool on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pooling.MySQLConnectionPool(pool_name="griddigger", pool_size=DB_POOL_SIZE, **db_config())
+        return _pool
+
 
 def create_connection():
-    """Create a database connection."""
+    """Get a database connection from the pool; close_connection() hands it back."""
     try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            database=os.getenv('DB_DATABASE'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            port=os.getenv('DB_PORT')
-        )
+        connection = get_pool().get_connection()
         if connection.is_connected():
             return connection
+        close_connection(connection)
     except Error as e:
         print("Error while connecting to MySQL", e)
     return None
 
 
+def close_connection(connection, cursor=None):
+    """Return a pooled connection even if it dropped, a connection that is never closed is lost to the pool."""
+    if not connection:
+        return
+    if cursor is not None:
+        try:
+            cursor.close()
+        except Error as e:
+            print("Error while closing cursor", e)
+    try:
+        # the pool takes the connection back even when resetting its session fails
+        connection.close()
+    except Error as e:
+        print("Error while closing connection", e)
+
+
 
 def create_users_table():
     """Create or alter the users table to include user_id and user_name."""
@@ -51,8 +98,7 @@ def create_users_table():
     except Error as e:
         print("Error while creating or updating table", e)
     finally:
-        if connection and connection.is_connected():
-            connection.close()
+        close_connection(connection)
 
 
 def create_user_stats_table():
@@ -77,12 +123,12 @@ def create_user_stats_table():
     except Error as e:
         print("Error while creating user_stats table", e)
     finally:
-        if connection and connection.is_connected():
-            connection.close()
+        close_connection(connection)
 
 
 def add_user(user_id, user_name=None):
     """Add a user to the users table or update their name if they already exist."""
+    cursor = None
     try:
         connection = create_connection()
         if connection:
@@ -96,17 +142,16 @@ def add_user(user_id, user_name=None):
             else:
                 cursor.execute("INSERT IGNORE INTO users (user_id) VALUES (%s);", (user_id,))
             connection.commit()
-            print(f"User {user_id} added or updated successfully.")
+            logging.debug("User %s added or updated successfully.", user_id)
     except Error as e:
         print("Error while adding or updating user", e)
     finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+        close_connection(connection, cursor)
 
 
 def show_user_data(user_id):
     """Show user data including ID, name, and stats."""
+    cursor = None
     try:
         connection = create_connection()
         if connection:
@@ -127,9 +172,7 @@ def show_user_data(user_id):
     except Error as e:
         print("Error while fetching user data", e)
     finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+        close_connection(connection, cursor)
 
 
 def generate_database_design():
@@ -159,12 +202,12 @@ def generate_database_design():
     except Error as e:
         print("Error while generating database design", e)
     finally:
-        if connection and connection.is_connected():
-            connection.close()
+        close_connection(connection)
 
 
 def display_users():
     """Display all users from the users table."""
+    cursor = None
     try:
         connection = create_connection()
         if connection:
@@ -177,40 +220,47 @@ def display_users():
     except Error as e:
         print("Error while fetching users", e)
     finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+        close_connection(connection, cursor)
+
+def queue_fetch_count(user_id):
+    """Queue a fetch_count increment for user_id; it is written by flush_fetch_counts()."""
+    with _pending_fetch_counts_lock:
+        _pending_fetch_counts[user_id] += 1
 
-def increment_fetch_count(user_id):
-    """Increment the fetch_count for the specified user_id."""
+
+def flush_fetch_counts():
+    """Write all queued fetch_count increments to user_stats in a single batch."""
+    with _pending_fetch_counts_lock:
+        if not _pending_fetch_counts:
+            return
+        pending = dict(_pending_fetch_counts)
+        _pending_fetch_counts.clear()
+    flushed = False
     try:
         connection = create_connection()
         if connection:
             with connection.cursor() as cursor:
-                # Check if user_id exists in users table
-                cursor.execute("SELECT 1 FROM users WHERE user_id = %s;", (user_id,))
-                if cursor.fetchone():
-                    # Ensure the user exists in user_stats
-                    cursor.execute("""
-                        INSERT INTO user_stats (user_id) 
-                        VALUES (%s) 
-                        ON DUPLICATE KEY UPDATE user_id=user_id;
-                    """, (user_id,))
-                    # Increment the fetch_count
-                    cursor.execute("""
-                        UPDATE user_stats
-                        SET fetch_count = fetch_count + 1
-                        WHERE user_id = %s;
-                    """, (user_id,))
+                # Only users that exist in the users table can have stats
+                placeholders = ', '.join(['%s'] * len(pending))
+                cursor.execute(f"SELECT user_id FROM users WHERE user_id IN ({placeholders});", tuple(pending))
+                rows = [(user_id, pending[user_id]) for (user_id,) in cursor.fetchall()]
+                if rows:
+                    cursor.executemany("""
+                        INSERT INTO user_stats (user_id, fetch_count)
+                        VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE fetch_count = fetch_count + VALUES(fetch_count);
+                    """, rows)
                     connection.commit()
-                    print(f"Fetch count incremented for user_id: {user_id}")
-                else:
-                    print(f"User ID {user_id} does not exist in users table.")
+                flushed = True
+                logging.debug("Fetch counts flushed for %s users.", len(rows))
     except Error as e:
-        print("Error while incrementing fetch_count", e)
+        print("Error while flushing fetch counts", e)
     finally:
-        if connection and connection.is_connected():
-            connection.close()
+        close_connection(connection)
+        if not flushed:
+            # Put the counts back so the next flush retries them
+            with _pending_fetch_counts_lock:
+                _pending_fetch_counts.update(pending)
 
 def increment_expand_count(user_id):
     """Increment the expand_count for the specified user_id."""
@@ -234,14 +284,13 @@ def increment_expand_count(user_id):
                         WHERE user_id = %s;
                     """, (user_id,))
                     connection.commit()
-                    print(f"Expand count incremented for user_id: {user_id}")
+                    logging.debug("Expand count incremented for user_id: %s", user_id)
                 else:
                     print(f"User ID {user_id} does not exist in users table.")
     except Error as e:
         print("Error while incrementing expand_count", e)
     finally:
-        if connection and connection.is_connected():
-            connection.close()
+        close_connection(connection)
 
 
 
@@ -7,9 +7,18 @@ from handlers import FILTER_MAIN
 from handlers.utils import generate_applied_filters_text, create_main_menu_filter_keyboard
 
 
+def load_long_message(name):
+    with open(f"handlers/long_messages/{name}.txt", "r") as f:
+        return f.read()
+
+
+# read once at import instead of reopening the file on every command
+START_MESSAGE = load_long_message("start")
+HELP_MESSAGE = load_long_message("help")
+OPEN_SOURCE_MESSAGE = load_long_message("open_source")
+
 def start(update: Update, context) -> int:
-    txt = open("handlers/long_messages/start.txt", "r").read()
-    update.message.reply_text(txt)
+    update.message.reply_text(START_MESSAGE)
     database.add_user(update.effective_user.id)
     return -1 #SEARCH_READY
 
@@ -29,11 +38,9 @@ def filter(update: Update, context) -> int:
     return FILTER_MAIN
 
 def open_source_command(update: Update, context) -> None:
-    txt = open("handlers/long_messages/open_source.txt", "r").read()
-    update.message.reply_text(txt)
+    update.message.reply_text(OPEN_SOURCE_MESSAGE)
 
 
 def help_command(update: Update, context) -> None:
-    txt = open("handlers/long_messages/help.txt", "r").read()
-    update.message.reply_text(txt)
+    update.message.reply_text(HELP_MESSAGE)
 
@@ -4,7 +4,7 @@ from telegram.ext import ContextTypes, ConversationHandler
 import api
 from handlers import FILTER_MAIN, FILTER_SUB, FILTER_CHOICES, FILTER_FILLING, utils
 from api import get_profiles
-from handlers.utils import show_profiles, generate_applied_filters_text, create_main_menu_filter_keyboard
+from handlers.utils import show_profiles, generate_applied_filters_text, create_main_menu_filter_keyboard, MAX_SHOWN_PROFILES
 
 
 def show_filters_main_menu(update: Update, context) -> int:
@@ -69,22 +69,15 @@ def handle_filter_sub_callback(update: Update, context) -> int:
     print("filter_type", filter_type)
     print("sub_filter", sub_filter)
 
-    # Fetch sub-filters dynamically based on filter_type
-    sub_filters = api.get_sub_filters(filter_type)
-
-    print("sub_filters", sub_filters)
-
     # Determine the filter type (searchable or multiple)
-    filter_meta = next((f for f in sub_filters if f['query'] == sub_filter), None)
+    filter_meta = api.get_sub_filter_meta(filter_type, sub_filter)
     if not filter_meta:
         context.bot.send_message(chat_id=update.effective_chat.id, text="Something wrong happened")
         return show_filters_main_menu(update, context)
 
     print("filter label", filter_meta['label'])
     filter_type = filter_meta['type']
-    data['current_filter'] = {}
     data['current_filter'] = sub_filter
-    data['current_filter_type'] = {}
     data['current_filter_type'] = filter_type
 
 
@@ -179,7 +172,7 @@ def handle_filter_filling_text(update: Update, context) -> int:
 
         profiles = api.get_profiles(data)
         profile_count = len(profiles)
-        display_results_count = min(profile_count, 20)
+        display_results_count = min(profile_count, MAX_SHOWN_PROFILES)
 
         # Fetch sub-filters dynamically based on filter_type
         sub_filters = api.get_sub_filters(filter_type)
@@ -226,15 +219,12 @@ def show_sub_filters(update: Update, context) -> int:
         # Fetch sub-filters dynamically based on filter_type
         sub_filters = api.get_sub_filters(filter_type)
 
-        filters = data.get('FILTERS', {})
-        profile_filter_emoji = "🟡" if 'profileNameSearch' in filters or 'profileType' in filters or 'profileSector' in filters or 'profileStatuses' in filters else '🟢'
-
         # Extract labels from sub_filters and create buttons
         buttons = [[InlineKeyboardButton(f"{'🟡' if data['FILTERS'].get(sub_filter['query']) else '🟢'}{sub_filter['label']}",
                                          callback_data=f"{filter_type}_{sub_filter['query']}")]
                    for sub_filter in sub_filters]
         buttons.insert(0, [InlineKeyboardButton("Reset", callback_data=f"reset_{filter_type}_filters"),
-                           InlineKeyboardButton(f"Show profiles ({profile_count})",
+                           InlineKeyboardButton(f"Show profiles ({min(profile_count, MAX_SHOWN_PROFILES)})",
                                                 callback_data=f"show_{filter_type}_filters")])
         buttons.append([InlineKeyboardButton("Back", callback_data="back_to_main_filters")])
         reply_markup = InlineKeyboardMarkup(buttons)
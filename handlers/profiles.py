@@ -1,4 +1,5 @@
-import os
+from operator import itemgetter
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
@@ -6,9 +7,7 @@ import api
 from database import increment_expand_count
 from handlers import utils, FILTER_MAIN
 from handlers.filters import show_sub_filters, show_filters_main_menu
-from handlers.utils import show_profiles
-
-MONITORING_GROUP_ID = os.getenv('MONITORING_GROUP_ID')
+from handlers.utils import show_profiles, escape_markdown
 
 # Define a function to split the message text
 def split_message(text, max_length):
@@ -17,6 +16,17 @@ def split_message(text, max_length):
 # Maximum length for Telegram media captions
 MAX_CAPTION_LENGTH = 1024
 
+# Profile url fields and their button labels, in the order the buttons are shown
+URL_BUTTON_LABELS = (
+    ('urlMain', 'Website'),
+    ('urlDocumentation', 'Documentation'),
+    ('urlWhitepaper', 'Whitepaper'),
+    ('urlBlog', 'Blog'),
+)
+
+# Name of a product/asset entry
+get_name = itemgetter('name')
+
 def handle_filter_main_callback(update: Update, context) -> int:
     query = update.callback_query
     query.answer()
@@ -43,7 +53,6 @@ def handle_filter_main_callback(update: Update, context) -> int:
 
     if query.data.endswith("_filters"):
         filter_type = query.data.split("_")[0]
-        data['filter_type'] = {}  # to avoid stupid errors
         data['filter_type'] = filter_type
 
         print("query.data", query.data)
@@ -59,48 +68,51 @@ def expand_profile_callback(update: Update, context):
 
     # Extract profile ID from the callback data
     profile_id = query.data.split('_')[1]
+    # Expand buttons always carry a numeric id, anything else is answered before it reaches the api or stats
+    if not api.is_valid_id(profile_id):
+        context.bot.send_message(chat_id=update.effective_chat.id, text="This profile can't be expanded.")
+        return
 
     # Fetch the full profile data
     profile_data = api.get_full_profile_data_by_id(profile_id)
+    if not profile_data:
+        context.bot.send_message(chat_id=update.effective_chat.id, text="This profile couldn't be loaded, try again later.")
+        return
 
     increment_expand_count(update.effective_user.id)
 
     # Send a monitoring message with user details
     user = update.effective_user
-    user_link = f"[{user.username}](tg://user?id={user.id})"
+    user_link = f"[{escape_markdown(user.username)}](tg://user?id={user.id})"
     monitoring_message_text = (
-        f"User {user.id} ({user_link}) expanded profile {profile_id} of name {profile_data['name']}"
+        f"User {user.id} ({user_link}) expanded profile {profile_id} of name {escape_markdown(profile_data['name'])}"
     )
-    context.bot.send_message(text=monitoring_message_text, parse_mode='Markdown', chat_id=MONITORING_GROUP_ID)
+    utils.send_monitoring_message(context, user.id, monitoring_message_text, parse_mode='Markdown')
 
 
     # Construct full profile message text
-    message_text = f"*ID:* {profile_data['id']}\n"
-    message_text += f"*Name:* {profile_data['name']}\n"
-    message_text += f"*Sector:* {profile_data['profileSector']['name'] if profile_data.get('profileSector') else '-'}\n"
-    message_text += f"*Type:* {profile_data['profileType']['name'] if profile_data.get('profileType') else '-'}\n"
-    message_text += f"*Status:* {profile_data['profileStatus']['name'] if profile_data.get('profileStatus') else '-'}\n"
-    message_text += f"*Founding Date:* {profile_data.get('foundingDate', '-')}\n"
-    message_text += f"*Slug:* {profile_data.get('slug', '-')}\n"
-    #message_text += f"*Description:* {profile_data.get('descriptionShort', '-')}\n" it might get too long (telegram.error.BadRequest: Media_caption_too_long)
-    message_text += f"*Long Description:* {profile_data.get('descriptionLong', '-')}\n"
-    message_text += f"*Tag Line:* {profile_data.get('tagLine', '-')}\n"
-    message_text += f"*Main Product Type:* {', '.join([product['name'] for product in profile_data.get('products', [])])}\n" # you may remove this
-    message_text += f"*Issued Assets:* {', '.join([asset['name'] for asset in profile_data.get('assets', [])])}\n"
-
-
-    buttons = []
-    if profile_data.get('urlMain'):
-        buttons.append([InlineKeyboardButton("Website", url=profile_data['urlMain'])])
-    if profile_data.get('urlDocumentation'):
-        buttons.append([InlineKeyboardButton("Documentation", url=profile_data['urlDocumentation'])])
-    if profile_data.get('urlWhitepaper'):
-        buttons.append([InlineKeyboardButton("Whitepaper", url=profile_data['urlWhitepaper'])])
-    if profile_data.get('urlBlog'):
-        buttons.append([InlineKeyboardButton("Blog", url=profile_data['urlBlog'])])
-    if profile_data.get('socials'):
-        for social in profile_data['socials']:
-            buttons.append([InlineKeyboardButton('Social', url=social['url'])])
+    # skip unnamed products/assets
+    products = escape_markdown(', '.join(filter(None, map(get_name, profile_data.get('products') or ()))))  # you may remove this
+    assets = escape_markdown(', '.join(filter(None, map(get_name, profile_data.get('assets') or ()))))
+    # *Description:* (descriptionShort) is left out, it might get too long (telegram.error.BadRequest: Media_caption_too_long)
+    message_text = (
+        f"*ID:* {profile_data['id']}\n"
+        f"*Name:* {escape_markdown(profile_data['name'])}\n"
+        f"*Sector:* {escape_markdown(utils.nested_name(profile_data, 'profileSector'))}\n"
+        f"*Type:* {escape_markdown(utils.nested_name(profile_data, 'profileType'))}\n"
+        f"*Status:* {escape_markdown(utils.nested_name(profile_data, 'profileStatus'))}\n"
+        f"*Founding Date:* {profile_data.get('foundingDate', '-')}\n"
+        f"*Slug:* {escape_markdown(profile_data.get('slug', '-'))}\n"
+        f"*Long Description:* {escape_markdown(profile_data.get('descriptionLong', '-'))}\n"
+        f"*Tag Line:* {escape_markdown(profile_data.get('tagLine', '-'))}\n"
+        f"*Main Product Type:* {products}\n"
+        f"*Issued Assets:* {assets}\n"
+    )
+
+
+    buttons = [[InlineKeyboardButton(label, url=profile_data[url_key])]
+               for url_key, label in URL_BUTTON_LABELS if profile_data.get(url_key)]
+    buttons.extend([InlineKeyboardButton('Social', url=social['url'])] for social in profile_data.get('socials') or ())
     reply_markup = InlineKeyboardMarkup(buttons) if buttons else None
 
     # Check if the original message has an image
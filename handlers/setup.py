@@ -1,11 +1,19 @@
 from telegram.ext import ConversationHandler, CommandHandler, filters, MessageHandler, CallbackQueryHandler
 
+import database
 from handlers import FILTER_MAIN, FILTER_SUB, FILTER_CHOICES, FILTER_FILLING
 from handlers.commands import start, help_command, filter, open_source_command
 from handlers.profiles import handle_filter_main_callback, expand_profile_callback
 from handlers.filters import handle_filter_main_text, handle_filter_sub_callback, handle_filter_choices_callback, \
     handle_filter_filling_text
 
+# How often the queued user stats are written to the database, in seconds
+STATS_FLUSH_INTERVAL = 5
+
+
+def flush_user_stats(context):
+    database.flush_fetch_counts()
+
 
 def setup(application):
     conv_handler = ConversationHandler(
@@ -33,4 +41,6 @@ def setup(application):
     application.add_handler(conv_handler)  # for flows
     application.add_handler(CallbackQueryHandler(expand_profile_callback, pattern=r'^expand_'))
 
+    application.job_queue.run_repeating(flush_user_stats, interval=STATS_FLUSH_INTERVAL)
+
     #application.run_polling(allowed_updates=Update.ALL_TYPES, poll_interval=0)
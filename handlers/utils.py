@@ -1,45 +1,90 @@
+import functools
+import logging
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
+import requests
+from requests.adapters import HTTPAdapter
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ConversationHandler, ContextTypes
 
 import api
-from database import increment_fetch_count
+from database import queue_fetch_count
 
 MONITORING_GROUP_ID = os.getenv('MONITORING_GROUP_ID')
+# Identical monitoring messages from the same user within this window are only sent once
+MONITORING_DEBOUNCE_SECONDS = 5
+_recent_monitoring_messages = {}
+# Number of profile details fetched in parallel by show_profiles
+PROFILE_FETCH_WORKERS = 5
+# show_profiles sends at most this many profile cards, result counts on buttons are capped to match
+MAX_SHOWN_PROFILES = 20
+
+# Shared session so logo downloads reuse connections to the same hosts
+image_session = requests.Session()
+image_session.headers.update({'User-Agent': 'Mozilla/5.0'})
+image_session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+image_session.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+IMAGE_DOWNLOAD_TIMEOUT = 10
+
+SUPPORTED_IMAGE_FORMATS = frozenset({'.jpg', '.jpeg', '.png'})
+CONVERTIBLE_IMAGE_FORMATS = frozenset()  # {'.svg', '.webp'} here where you turn it on
+
+# Filter keys that mark each filter category as active on the main menu
+PROFILE_FILTER_KEYS = frozenset({'profileNameSearch', 'profileType', 'profileSector', 'profileStatuses'})
+PRODUCT_FILTER_KEYS = frozenset({'productTypes', 'productStatuses'})
+ENTITY_FILTER_KEYS = frozenset({'entityTypes', 'entityName'})
+ASSET_FILTER_KEYS = frozenset({'assetTickers', 'assetTypes', 'assetStandards'})
 
 
 def create_main_menu_filter_keyboard(user_data, results_count):
-    # Limit the number of results shown on the button text to 20
-    display_results_count = min(results_count, 20)
+    # Limit the number of results shown on the button text to the number of profiles show_profiles sends
+    display_results_count = min(results_count, MAX_SHOWN_PROFILES)
 
     # Retrieve filters from user data
     filters = user_data.get('FILTERS', {})
 
-    # Determine the appropriate emoji for each filter type
-    profile_filter_emoji = "🟡" if 'profileNameSearch' in filters or 'profileType' in filters or 'profileSector' in filters or 'profileStatuses' in filters else '🟢'
-    product_filter_emoji = "🟡" if 'productTypes' in filters or 'productStatuses' in filters else '🟢'
-    entity_filter_emoji = "🟡" if 'entityTypes' in filters or 'entityName' in filters else '🟢'
-    asset_filter_emoji = "🟡" if 'assetTickers' in filters or 'assetTypes' in filters or 'assetStandards' in filters else '🟢'
-
-    solana_toggle_text = "✔️Solana filter" if user_data.get('solana_filter_toggle', True) else "Solana filter"
-
+    # Determine which filter types are active
+    filter_keys = filters.keys()
+    return _build_main_menu_filter_keyboard(bool(filter_keys & PROFILE_FILTER_KEYS),
+                                            bool(filter_keys & PRODUCT_FILTER_KEYS),
+                                            bool(filter_keys & ASSET_FILTER_KEYS),
+                                            bool(filter_keys & ENTITY_FILTER_KEYS),
+                                            bool(user_data.get('solana_filter_toggle', True)),
+                                            bool(user_data.get('inc_search')),
+                                            display_results_count)
+
+
+# Button labels indexed by whether the filter type or toggle is active
+PROFILE_FILTERS_LABELS = ('🟢Profile filters', '🟡Profile filters')
+PRODUCT_FILTERS_LABELS = ('🟢Product filters', '🟡Product filters')
+ASSET_FILTERS_LABELS = ('🟢Asset filters', '🟡Asset filters')
+ENTITY_FILTERS_LABELS = ('🟢Entity filters', '🟡Entity filters')
+SOLANA_FILTER_LABELS = ('Solana filter', '✔️Solana filter')
+INC_SEARCH_LABELS = ('Inc search', '✔️Inc search')
+
+
+# The keyboard only depends on these few flags, so identical menus share one markup object
+@functools.lru_cache(maxsize=256)
+def _build_main_menu_filter_keyboard(profile_active, product_active, asset_active, entity_active,
+                                     solana_filter, inc_search, display_results_count):
     # Create buttons
     keyboard_buttons = [
         [InlineKeyboardButton('🔄Reset filters', callback_data='reset_all')],
-        [InlineKeyboardButton(f'{profile_filter_emoji}Profile filters', callback_data='profile_filters'),
-         InlineKeyboardButton(f'{product_filter_emoji}Product filters', callback_data='product_filters')],
-        [InlineKeyboardButton(f'{asset_filter_emoji}Asset filters', callback_data='asset_filters'),
-         InlineKeyboardButton(f'{entity_filter_emoji}Entity filters', callback_data='entity_filters')],
-        [InlineKeyboardButton(f'{solana_toggle_text}', callback_data='solana_filter_toggle'),
-         InlineKeyboardButton(f"{'✔️' if user_data.get('inc_search') else ''}Inc search",
-                              callback_data='inc_search')]
+        [InlineKeyboardButton(PROFILE_FILTERS_LABELS[profile_active], callback_data='profile_filters'),
+         InlineKeyboardButton(PRODUCT_FILTERS_LABELS[product_active], callback_data='product_filters')],
+        [InlineKeyboardButton(ASSET_FILTERS_LABELS[asset_active], callback_data='asset_filters'),
+         InlineKeyboardButton(ENTITY_FILTERS_LABELS[entity_active], callback_data='entity_filters')],
+        [InlineKeyboardButton(SOLANA_FILTER_LABELS[solana_filter], callback_data='solana_filter_toggle'),
+         InlineKeyboardButton(INC_SEARCH_LABELS[inc_search], callback_data='inc_search')]
     ]
 
-    # Add "Show profiles" button if results_count > 0
-    if results_count > 0:
+    # Add "Show profiles" button if there are any results
+    if display_results_count > 0:
         keyboard_buttons.insert(0, [
             InlineKeyboardButton(f'Show profiles ({display_results_count})', callback_data='show')])
 
@@ -50,103 +95,116 @@ def create_main_menu_filter_keyboard(user_data, results_count):
 
 def show_profiles(data, update: Update, context):
     profiles = api.get_profiles(data)
+    filters_text = generate_applied_filters_text(data)
 
-    increment_fetch_count(update.effective_user.id)
+    queue_fetch_count(update.effective_user.id)
     # Send a monitoring message with user details
     user = update.effective_user
     monitoring_message_text = (
         f"User {user.id} ({user.username}) showed "
-        f"{min(len(profiles), 20)} of these settings:\n{generate_applied_filters_text(data)}"
-    )
-    context.bot.send_message(
-        text=monitoring_message_text,
-        chat_id=MONITORING_GROUP_ID
+        f"{min(len(profiles), MAX_SHOWN_PROFILES)} of these settings:\n{filters_text}"
     )
+    send_monitoring_message(context, user.id, monitoring_message_text)
     # edit the message and remove the buttons
     context.bot.edit_message_text(
         chat_id=update.effective_chat.id,
         message_id=update.effective_message.message_id,
-        text=f"Showing profiles with applied filters: \n\n {generate_applied_filters_text(data)}",
+        text=f"Showing profiles with applied filters: \n\n {filters_text}",
         reply_markup=None
     )
-    for profile in profiles[:20]:
-        try:
-            send_profile_message(update, context, profile)
-        except Exception as e:
-            context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error: {e}")
+    # Fetch the profile details concurrently, but keep sending the messages in order
+    with ThreadPoolExecutor(max_workers=PROFILE_FETCH_WORKERS) as executor:
+        profile_futures = [executor.submit(api.get_profile_data_by_id, profile['id']) for profile in profiles[:MAX_SHOWN_PROFILES]]
+        for profile_future in profile_futures:
+            try:
+                send_profile_message(update, context, profile_future.result())
+            except Exception as e:
+                context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error: {e}")
 
     return ConversationHandler.END
 
 
-def send_profile_message(update: Update, context, profile):
-    profile_id = profile['id']
-    profile_data = api.get_profile_data_by_id(profile_id)
+def send_monitoring_message(context, user_id, text, **kwargs):
+    """Send a message to the monitoring group without blocking the user's response."""
+    now = time.monotonic()
+    key = (user_id, hash(text))
+    sent_at = _recent_monitoring_messages.get(key)
+    if sent_at is not None and now - sent_at < MONITORING_DEBOUNCE_SECONDS:
+        return
+    if len(_recent_monitoring_messages) > 1024:
+        for stale_key in [k for k, sent_at in _recent_monitoring_messages.items()
+                          if now - sent_at >= MONITORING_DEBOUNCE_SECONDS]:
+            del _recent_monitoring_messages[stale_key]
+    _recent_monitoring_messages[key] = now
+    context.dispatcher.run_async(_send_monitoring_message, context.bot, text, kwargs)
+
+
+def _send_monitoring_message(bot, text, kwargs):
+    try:
+        bot.send_message(text=text, chat_id=MONITORING_GROUP_ID, **kwargs)
+    except Exception as e:
+        logging.warning("Failed to send monitoring message: %s", e)
+
+
+def nested_name(data, key, default='-'):
+    """Return data[key]['name'], or default when the nested object is missing."""
+    nested = data.get(key)
+    return nested['name'] if nested else default
+
+
+def send_profile_message(update: Update, context, profile_data):
+    profile_id = profile_data['id']
 
     # Construct initial message text with basic profile summary
-    message_text = f"*Name:* {profile_data['name']}\n"
-    message_text += f"*Sector:* {profile_data['profileSector']['name'] if profile_data.get('profileSector') else '-'}\n"
-    message_text += f"*short description:* {profile_data['descriptionShort'] if profile_data.get('descriptionShort') else '-'}\n"
+    description = profile_data.get('descriptionShort')
+    message_text = (
+        f"*Name:* {escape_markdown(profile_data['name'])}\n"
+        f"*Sector:* {escape_markdown(nested_name(profile_data, 'profileSector'))}\n"
+        f"*short description:* {escape_markdown(description) if description else '-'}\n"
+    )
     # Add the "Expand" button
-    buttons = [[InlineKeyboardButton("Expand", callback_data=f"expand_{profile_id}")]]
-
-    reply_markup = InlineKeyboardMarkup(buttons)
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Expand", callback_data=f"expand_{profile_id}")]])
 
     # Check if the logo URL is valid and in a supported format
     logo_url = profile_data.get('logo')
-    # Usage in your Telegram bot
-    if logo_url and is_valid_url(logo_url):
-        if is_supported_image_format(logo_url):
-            download_and_send_image(logo_url, update.effective_chat.id, message_text, reply_markup, context)
-        else:
-            context.bot.send_message(chat_id=update.effective_chat.id, text=message_text, parse_mode='Markdown',
-                                     reply_markup=reply_markup)
+    if logo_url and is_supported_image_url(logo_url):
+        download_and_send_image(logo_url, update.effective_chat.id, message_text, reply_markup, context)
     else:
         context.bot.send_message(chat_id=update.effective_chat.id, text=message_text, parse_mode='Markdown',
                                  reply_markup=reply_markup)
 
 
-import requests
-
 def download_and_send_image(url, chat_id, message_text, reply_markup, context):
+    # Any problem with the logo falls back to the plain text card, the profile is always shown
     try:
-        response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+        response = image_session.get(url, timeout=IMAGE_DOWNLOAD_TIMEOUT)
         if response.status_code == 200:
-            with open('temp_image.png', 'wb') as f:
-                f.write(response.content)
-            context.bot.send_photo(chat_id=chat_id, photo=open('temp_image.png', 'rb'), caption=message_text,
+            context.bot.send_photo(chat_id=chat_id, photo=response.content, caption=message_text,
                                    parse_mode='Markdown', reply_markup=reply_markup)
-        else:
-            context.bot.send_message(chat_id=chat_id, text="Failed to download image.", parse_mode='Markdown', reply_markup=reply_markup)
-    except requests.exceptions.RequestException as e:
-        context.bot.send_message(chat_id=chat_id, text=f"Error: {str(e)}", parse_mode='Markdown', reply_markup=reply_markup)
+            return
+        logging.warning("Logo download failed with status %s: %s", response.status_code, url)
+    except (requests.exceptions.RequestException, TelegramError) as e:
+        logging.warning("Could not send logo %s: %s", url, e)
+    context.bot.send_message(chat_id=chat_id, text=message_text, parse_mode='Markdown', reply_markup=reply_markup)
 
 
+def classify_url(url):
+    """Parse the url once and return it along with its lowercased file extension."""
+    parsed = urlparse(url)
+    return parsed, os.path.splitext(parsed.path)[1].lower()
 
-def is_valid_url(url):
-    print("url", url)
-    regex = re.compile(
-        r'^(?:http|ftp)s?://'  # http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
-        r'localhost|'  # localhost...
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|'  # ...or ipv4
-        r'\[?[A-F0-9]*:[A-F0-9:]+\]?)'  # ...or ipv6
-        r'(?::\d+)?'  # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return re.match(regex, url) is not None
 
-
-def is_supported_image_format(url):
-    supported_formats = {}#{'.jpg', '.jpeg', '.png'}
-    path = urlparse(url).path
-    _, ext = os.path.splitext(path)
-    return ext.lower() in supported_formats
+def is_supported_image_url(url):
+    """An http(s) url with a host and a supported image extension, checked from a single parse."""
+    try:
+        parsed, ext = classify_url(url)
+    except ValueError:  # e.g. a malformed IPv6 host
+        return False
+    return parsed.scheme in ('http', 'https') and bool(parsed.netloc) and ext in SUPPORTED_IMAGE_FORMATS
 
 
 def is_convertible_image_format(url):
-    convertible_formats = {}  # {'.svg', '.webp'} here where you turn it on
-    path = urlparse(url).path
-    _, ext = os.path.splitext(path)
-    return ext.lower() in convertible_formats
+    return classify_url(url)[1] in CONVERTIBLE_IMAGE_FORMATS
 
 
 # for measuring execution time
@@ -235,44 +293,47 @@ def reset_filters(data) -> bool:
     # return True
 
 
-def generate_applied_filters_text(data):
-    data.setdefault("FILTERS", {})
+# Sub-filter labels from filters.json, so applied filters read "Profile Type: DAO" instead of "profileType: DAO"
+FILTER_LABELS = {sub_filter['query']: sub_filter['label']
+                 for sub_filters in api.sub_filters_config.values() for sub_filter in sub_filters}
 
-    # Initialize a dictionary to hold filter names and values
-    filters_text = {}
 
-    # Iterate through the filters and extract the values
-    for key, value in data["FILTERS"].items():
-        if not key.endswith('_query'):
-            filters_text[key] = value
-
-    # Generate the output text
-    result = '\n'.join(f"{key}: {value}" for key, value in filters_text.items())
-
-    return result
+def generate_applied_filters_text(data):
+    # Query values (the '_query' keys) are internal, only display values that are set are listed
+    applied_filters = '\n'.join(f"{FILTER_LABELS.get(key, key)}: {value}"
+                                 for key, value in data.setdefault("FILTERS", {}).items()
+                                 if not key.endswith('_query') and value not in (None, ""))
+    return applied_filters or "No filters applied"
 
 
-def toggle_inc_search(data):
+def toggle_inc_search(data) -> bool:
     # # Toggle the 'inc_search' flag
     # if not data['FILTERS']:
     #     data['FILTERS'] = {}
 
-    data.setdefault('inc_search', False)
-    data['inc_search'] = not data['inc_search']  # a label on filter menu
-    print("inc_search:", data['inc_search'])
+    inc_search = data['inc_search'] = not data.get('inc_search', False)  # a label on filter menu
+    logging.debug("inc_search: %s", inc_search)
+    return inc_search
 
-def toggle_solana_filter(data):
+def toggle_solana_filter(data) -> bool:
     # # Toggle the 'inc_search' flag
     # if not data['FILTERS']:
     #     data['FILTERS'] = {}
 
-    data.setdefault('solana_filter_toggle', True)
-    data['solana_filter_toggle'] = not data['solana_filter_toggle']  # a label on filter menu
-    print("solana_filter_toggle:", data['solana_filter_toggle'])
+    solana_filter = data['solana_filter_toggle'] = not data.get('solana_filter_toggle', True)  # a label on filter menu
+    logging.debug("solana_filter_toggle: %s", solana_filter)
+    return solana_filter
 
 
 # some user names have special characters that cause errors.
+MARKDOWN_ESCAPE_TABLE = str.maketrans({char: '\\' + char for char in '*_`['})
+# Most names and descriptions have none of these, a single regex scan lets them through unchanged
+MARKDOWN_SPECIAL_CHARS = re.compile(r'[*_`\[]')
+
+
 def escape_markdown(text):
     """Helper function to escape special characters for Markdown."""
-    escape_chars = r'\*_`\['
-    return re.sub(r'([{}])'.format(escape_chars), r'\\\1', text)
+    text = str(text)
+    if not MARKDOWN_SPECIAL_CHARS.search(text):
+        return text
+    return text.translate(MARKDOWN_ESCAPE_TABLE)